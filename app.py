@@ -1,18 +1,28 @@
 # 🔧 Full Offline QA-Enabled Streamlit App with Local BERT
 
+import hashlib
+import os
 import streamlit as st
-import pdfplumber
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+import fitz  # PyMuPDF
 import faiss
 import numpy as np
 import random
+import tempfile
+import torch
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from transformers import pipeline
+from transformers import AutoTokenizer, pipeline
+
+try:
+    from model2vec import StaticModel
+except ImportError:
+    StaticModel = None
 
 # ----------------------------
 # 🌸 Streamlit Configuration
 # ----------------------------
 st.set_page_config(page_title="🧠 Offline Smart Research Chatbot", layout="wide")
+torch.set_num_threads(os.cpu_count() or 1)
 
 # ----------------------------
 # 🎨 Custom Styling (Optional)
@@ -32,41 +42,205 @@ local_css()
 # ----------------------------
 # 🔍 Load Models
 # ----------------------------
+STATIC_EMBED_MODEL = "minishlab/potion-base-8M"
+EMBED_MODEL = "all-MiniLM-L6-v2"
+QA_MODEL = "distilbert-base-cased-distilled-squad"
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_CACHE_DIR = os.path.join(APP_DIR, "models")
+
+def cpu_has_vnni():
+    # INT8 kernels only pay off with AVX512-VNNI; elsewhere stay on FP32
+    try:
+        with open("/proc/cpuinfo") as f:
+            return "avx512_vnni" in f.read()
+    except OSError:
+        return False
+
+def load_quantized_embedder():
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    path = os.path.join(MODEL_CACHE_DIR, f"{EMBED_MODEL}-onnx")
+    file_name = "onnx/model_qint8_avx512_vnni.onnx"
+    if not os.path.exists(os.path.join(path, file_name)):
+        model = SentenceTransformer(EMBED_MODEL, backend="onnx")
+        model.save_pretrained(path)
+        export_dynamic_quantized_onnx_model(model, "avx512_vnni", path)
+    return SentenceTransformer(path, backend="onnx", model_kwargs={"file_name": file_name})
+
+def load_quantized_qa_model():
+    from optimum.onnxruntime import ORTModelForQuestionAnswering, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    path = os.path.join(MODEL_CACHE_DIR, f"{QA_MODEL}-int8")
+    file_name = "model_quantized.onnx"
+    if not os.path.exists(os.path.join(path, file_name)):
+        ort_model = ORTModelForQuestionAnswering.from_pretrained(QA_MODEL, export=True)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=True)
+        ORTQuantizer.from_pretrained(ort_model).quantize(save_dir=path, quantization_config=qconfig)
+        AutoTokenizer.from_pretrained(QA_MODEL).save_pretrained(path)
+    ort_model = ORTModelForQuestionAnswering.from_pretrained(path, file_name=file_name)
+    tok = AutoTokenizer.from_pretrained(path)
+    return pipeline("question-answering", model=ort_model, tokenizer=tok)
+
+def compile_embedder(embedder):
+    # reduce-overhead means CUDA graphs; on CPU it only adds Inductor compile time
+    backbone = embedder[0].auto_model
+    if embedder.device.type != "cuda" or not hasattr(torch, "compile"):
+        return embedder
+    try:
+        embedder[0].auto_model = torch.compile(backbone, mode="reduce-overhead", dynamic=True)
+        embedder.encode(["warm up"])  # compilation is lazy, so surface failures here
+    except Exception:
+        embedder[0].auto_model = backbone
+    return embedder
+
+def fuse_qa_model(qa_model):
+    if not isinstance(qa_model.model, torch.nn.Module):
+        return qa_model
+    try:
+        from optimum.bettertransformer import BetterTransformer
+        qa_model.model = BetterTransformer.transform(qa_model.model)
+    except Exception:
+        pass  # needs optimum and a supported torch/transformers pair
+    return qa_model
+
+def is_static(embedder):
+    return StaticModel is not None and isinstance(embedder, StaticModel)
+
+def embed(embedder, texts, batch_size=64):
+    # Unit-normalized float32 vectors from either embedder, so inner product == cosine
+    if is_static(embedder):
+        vecs = np.asarray(embedder.encode(texts, batch_size=batch_size), dtype="float32")
+        faiss.normalize_L2(vecs)
+        return vecs
+    # encode() sorts by length inside each call, so bigger batches waste less padding
+    return embedder.encode(
+        texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True
+    ).astype("float32")
+
 @st.cache_resource
 def load_embedder():
-    return SentenceTransformer("all-MiniLM-L6-v2")
+    # Static token embeddings skip the transformer entirely; retrieval only needs rough topicality
+    if StaticModel is not None:
+        try:
+            return StaticModel.from_pretrained(STATIC_EMBED_MODEL)
+        except Exception:
+            pass
+    return load_sentence_embedder()
+
+@st.cache_resource
+def load_sentence_embedder():
+    # Answer grading thresholds are tuned for MiniLM cosines, so it always uses this model
+    if torch.cuda.is_available():
+        return compile_embedder(SentenceTransformer(EMBED_MODEL, device="cuda"))
+    if cpu_has_vnni():
+        try:
+            return load_quantized_embedder()
+        except Exception:
+            pass  # onnxruntime/optimum missing or export failed: use FP32
+    return SentenceTransformer(EMBED_MODEL)
 
 @st.cache_resource
 def load_qa_model():
-    return pipeline("question-answering", model="distilbert-base-cased-distilled-squad")
+    if cpu_has_vnni():
+        try:
+            return load_quantized_qa_model()
+        except Exception:
+            pass
+    return fuse_qa_model(pipeline("question-answering", model=QA_MODEL))
 
 # ----------------------------
 # 🧠 Build FAISS Index
 # ----------------------------
+@st.cache_resource
+def load_gpu_resources():
+    # faiss-cpu builds have no GPU symbols at all
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return None
+    return faiss.StandardGpuResources()
+
+INDEX_CACHE_DIR = os.path.join(APP_DIR, "cache")
+HNSW_THRESHOLD = 200
+
+def embedder_variant(embedder):
+    if is_static(embedder):
+        return STATIC_EMBED_MODEL
+    # INT8 ONNX and FP32 MiniLM vectors differ, so they must not share cache entries
+    if isinstance(embedder[0].auto_model, torch.nn.Module):
+        return f"{EMBED_MODEL}-fp32"
+    return f"{EMBED_MODEL}-onnx-qint8-avx512-vnni"
+
+def index_cache_paths(embedder, chunks):
+    # Key on the embedder variant and the extracted chunks, so a model or chunking change misses
+    h = hashlib.sha1(embedder_variant(embedder).encode())
+    for chunk in chunks:
+        h.update(chunk.encode())
+        h.update(b"\0")
+    key = h.hexdigest()
+    return os.path.join(INDEX_CACHE_DIR, f"{key}.faiss"), os.path.join(INDEX_CACHE_DIR, f"{key}.npy")
+
 @st.cache_resource
 def build_index(_embedder, chunks):
-    embeddings = _embedder.encode(chunks, convert_to_numpy=True)
+    index_path, emb_path = index_cache_paths(_embedder, chunks)
+    if os.path.exists(emb_path):
+        # mmap: a cold start re-encodes nothing and the page cache serves the vectors
+        embeddings = np.load(emb_path, mmap_mode="r")
+    else:
+        # FP16 storage halves the bytes scanned per query; ranking is unaffected for retrieval
+        embeddings = embed(_embedder, chunks).astype(np.float16)
+        os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=INDEX_CACHE_DIR, suffix=".npy", delete=False) as f:
+            np.save(f, embeddings)
+        os.replace(f.name, emb_path)
+
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
+    gpu_res = load_gpu_resources()
+    if gpu_res is not None:
+        index = faiss.IndexFlatIP(dim)
+        index.add(np.asarray(embeddings, dtype=np.float32))
+        co = faiss.GpuClonerOptions()
+        co.useFloat16 = True
+        index = faiss.index_cpu_to_gpu(gpu_res, 0, index, co)
+    elif os.path.exists(index_path):
+        index = faiss.read_index(index_path)
+    else:
+        vecs = np.asarray(embeddings, dtype=np.float32)
+        if len(chunks) > HNSW_THRESHOLD:
+            # graph walk touches ~log N vectors per query instead of scanning all of them
+            index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 40
+            index.add(vecs)
+            index.hnsw.efSearch = 16
+        else:
+            index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+            index.train(vecs)
+            index.add(vecs)
+        fd, tmp_path = tempfile.mkstemp(dir=INDEX_CACHE_DIR, suffix=".faiss")
+        os.close(fd)
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, index_path)
     return index, embeddings
 
 # ----------------------------
 # ✂️ Text Chunking
 # ----------------------------
-@st.cache_data
+def hash_uploaded_file(file):
+    # UploadedFile objects differ per upload; key on name + content so re-uploads hit the cache
+    return file.name, hashlib.md5(file.getvalue()).hexdigest()
+
+@st.cache_data(hash_funcs={UploadedFile: hash_uploaded_file}, persist="disk")
 def extract_text_chunks(files, max_pages=5):
     chunks = []
     for file in files:
         if file.name.endswith(".pdf"):
-            with pdfplumber.open(file) as pdf:
-                for page in pdf.pages[:max_pages]:
-                    text = page.extract_text() or ""
+            with fitz.open(stream=file.getvalue(), filetype="pdf") as doc:
+                for page in doc.pages(0, min(max_pages, doc.page_count)):
+                    text = page.get_text("text") or ""
                     text = text.replace("\n", " ").strip()
                     if len(text) > 100:
                         chunks.append(text)
         elif file.name.endswith(".txt"):
-            text = file.read().decode("utf-8")
+            text = file.getvalue().decode("utf-8")
             for para in text.split("\n\n"):
                 para = para.strip().replace("\n", " ")
                 if len(para) > 100:
@@ -76,20 +250,33 @@ def extract_text_chunks(files, max_pages=5):
 # ----------------------------
 # 🧪 Local QA over top chunks
 # ----------------------------
-def answer_question_from_chunks(question, chunks, qa_model, embedder, top_k=3):
-    q_vec = embedder.encode([question], convert_to_numpy=True)
-    doc_vecs = embedder.encode(chunks, convert_to_numpy=True)
-    sims = cosine_similarity(q_vec, doc_vecs)[0]
-    top_idxs = sims.argsort()[-top_k:][::-1]
+def truncate_question(question, tokenizer, max_tokens):
+    # Cut on a token boundary but keep the user's original text
+    enc = tokenizer(question, add_special_tokens=False, return_offsets_mapping=True)
+    if len(enc["input_ids"]) <= max_tokens:
+        return question
+    return question[:enc["offset_mapping"][max_tokens - 1][1]]
+
+def answer_question_from_chunks(question, chunks, qa_model, embedder, index, top_k=3, max_seq_len=384, doc_stride=128):
+    q_vec = embed(embedder, [question])
+    _, I = index.search(q_vec, min(top_k, len(chunks)))
+
+    # The pipeline windows long contexts itself, but only if the question leaves more than
+    # doc_stride tokens of room next to [CLS] q [SEP] ... [SEP]; a long pasted question would raise
+    question = truncate_question(question, qa_model.tokenizer, max_seq_len - doc_stride - 4)
+    contexts = [chunks[idx] for idx in I[0] if idx >= 0]
+    inputs = [{"question": question, "context": context} for context in contexts]
 
     answers = []
-    for idx in top_idxs:
-        context = chunks[idx]
-        try:
-            result = qa_model(question=question, context=context)
-            answers.append((result['answer'], result['score'], context))
-        except:
-            continue
+    if inputs:
+        # one batched forward over all top-k contexts instead of a Python loop
+        results = qa_model(
+            inputs, batch_size=len(inputs), max_seq_len=max_seq_len, doc_stride=doc_stride,
+            handle_impossible_answer=False,
+        )
+        if isinstance(results, dict):  # the pipeline unwraps single-item lists
+            results = [results]
+        answers = [(r['answer'], r['score'], context) for r, context in zip(results, contexts)]
 
     if not answers:
         return "Sorry, I couldn't find an answer.", None
@@ -100,31 +287,40 @@ def answer_question_from_chunks(question, chunks, qa_model, embedder, top_k=3):
 # ----------------------------
 # 📌 Summarizer (Simple)
 # ----------------------------
-def summarize_chunks(chunks, embedder, max_words=150):
-    vecs = embedder.encode(chunks, convert_to_numpy=True)
-    avg_vec = np.mean(vecs, axis=0)
-    scores = cosine_similarity([avg_vec], vecs)[0]
-    top_idxs = np.argsort(scores)[-5:][::-1]
+def top_k_indices(scores, k):
+    # argpartition is O(N); only the k survivors get sorted
+    k = min(k, len(scores))
+    idx = np.argpartition(scores, -k)[-k:]
+    return idx[np.argsort(scores[idx])[::-1]]
+
+def summarize_chunks(chunks, embeddings, max_words=150):
+    # embeddings are unit-normalized by build_index, so a dot product is the cosine
+    vecs = embeddings.astype(np.float32)  # stored as FP16; NumPy has no fast FP16 matmul
+    avg_vec = vecs.mean(axis=0)
+    scores = vecs @ avg_vec
+    top_idxs = top_k_indices(scores, 5)
     selected = " ".join([chunks[i] for i in top_idxs])
     return " ".join(selected.split()[:max_words]) + "..."
 
 # ----------------------------
 # ❓ Question Generator (for quiz mode)
 # ----------------------------
-def generate_questions(chunks, n=3):
-    sents = []
-    for ch in chunks:
-        sents += [s.strip() for s in ch.split(".") if len(s.strip().split()) > 5]
-    picked = random.sample(sents, min(n, len(sents)))
-    return [{"question": f"What is meant by: \"{s[:100]}...?\"", "answer": s, "source": s[:200] + "..."} for s in picked]
+def extract_sentences(chunks):
+    return [s.strip() for ch in chunks for s in ch.split(".") if len(s.strip().split()) > 5]
 
-def similarity_score(a, b, embedder):
-    vecs = embedder.encode([a, b], convert_to_numpy=True)
-    return cosine_similarity([vecs[0]], [vecs[1]])[0][0]
+def generate_questions(sentences, n=3):
+    picked = random.sample(sentences, min(n, len(sentences)))
+    return [{"question": f"What is meant by: \"{s[:100]}...?\"", "answer": s, "source": s[:200] + "..."} for s in picked]
 
-def is_answer_correct(user_answer, correct_answer, embedder, threshold=0.7):
-    score = similarity_score(user_answer, correct_answer, embedder)
-    return score >= threshold, score
+def grade_answers(user_answers, correct_answers, embedder, threshold=0.7):
+    # One encode call for every user + reference answer instead of one per pair
+    n = len(user_answers)
+    if n == 0:
+        return []
+    vecs = embed(embedder, list(user_answers) + list(correct_answers), batch_size=32)
+    # unit vectors, so each row-wise dot product is the cosine; no N x d temporary
+    scores = np.einsum("ij,ij->i", vecs[:n], vecs[n:])
+    return [(score >= threshold, float(score)) for score in scores]
 
 # ----------------------------
 # 🚀 Streamlit App
@@ -135,6 +331,7 @@ def main():
     st.markdown("<h1 style='font-size:2.8rem;'>🧠 Offline Smart Research Chatbot</h1>", unsafe_allow_html=True)
 
     embedder = load_embedder()
+    grader = load_sentence_embedder()
     qa_model = load_qa_model()
 
     if "chat_history" not in st.session_state:
@@ -152,11 +349,13 @@ def main():
                     st.warning("⚠️ No extractable content found in the files.")
                     return
 
-                index, _ = build_index(embedder, chunks)  # ✅ Unpacking only 2 values now
+                index, embeddings = build_index(embedder, chunks)
                 st.session_state.chunks = chunks
                 st.session_state.index = index
-                st.session_state.questions = generate_questions(chunks)
-                st.session_state.summary = summarize_chunks(chunks, embedder)
+                st.session_state.embeddings = embeddings
+                st.session_state.sentences = extract_sentences(chunks)
+                st.session_state.questions = generate_questions(st.session_state.sentences)
+                st.session_state.summary = summarize_chunks(chunks, embeddings)
                 st.session_state.chat_history.clear()
             st.success(f"✅ {len(chunks)} chunks processed.")
 
@@ -172,7 +371,11 @@ def main():
     if mode == "Ask Anything":
         q = st.text_input("Ask a question from the document:")
         if st.button("Get Answer") and q.strip():
-            answer, context = answer_question_from_chunks(q, st.session_state.chunks, qa_model, embedder)
+            # static embeddings rank more loosely, so hand the QA model more candidates
+            top_k = 10 if is_static(embedder) else 3
+            answer, context = answer_question_from_chunks(
+                q, st.session_state.chunks, qa_model, embedder, st.session_state.index, top_k=top_k
+            )
 
             st.success("✍️ Answer:")
             st.write(answer)
@@ -198,10 +401,14 @@ def main():
 
             if submitted:
                 score = 0
-                for i, q in enumerate(st.session_state.questions, 1):
-                    ua = answers[i].strip()
+                questions = st.session_state.questions
+                results = grade_answers(
+                    [answers[i].strip() for i in range(1, len(questions) + 1)],
+                    [q["answer"] for q in questions],
+                    grader,
+                )
+                for i, (q, (passed, sim)) in enumerate(zip(questions, results), 1):
                     correct = q["answer"]
-                    passed, sim = is_answer_correct(ua, correct, embedder)
                     if passed:
                         st.success(f"✅ Q{i}: Correct ({sim:.2f})")
                         score += 1
@@ -216,9 +423,9 @@ def main():
         if st.button("🎲 New Challenge"):
             import time
             random.seed(time.time())
-            new_qs = generate_questions(st.session_state.chunks)
+            new_qs = generate_questions(st.session_state.sentences)
             while new_qs == st.session_state.questions:
-                new_qs = generate_questions(st.session_state.chunks)
+                new_qs = generate_questions(st.session_state.sentences)
             st.session_state.questions = new_qs
             st.rerun()
 